@@ -1,10 +1,42 @@
 # Импорт необходимых библиотек
-import requests                                    # Библиотека для выполнения HTTP-запросов к API OpenRouter
+import httpx                                       # Асинхронный HTTP-клиент (HTTP/2, пул соединений) для запросов к API OpenRouter
+import asyncio                                     # Вынос синхронных запросов к SQLite из цикла событий
 import os                                          # Библиотека для работы с переменными окружения
+import json                                        # Сериализация списка моделей в дисковый кэш
+import time                                        # Проверка возраста дискового кэша моделей
+import hashlib                                     # Хэширование запросов для ключей кэша ответов
+from collections import OrderedDict                # Упорядоченный словарь для LRU-кэша ответов
 from dotenv import load_dotenv                     # Загрузка переменных из .env файла
 from utils.logger import AppLogger                 # Собственный логгер для отслеживания работы клиента
 
-load_dotenv()                                      # Загрузка .env при импорте модуля
+RESPONSE_CACHE_SIZE = 256                          # Максимум ответов в памяти
+RESPONSE_CACHE_TTL = 86400                         # Срок жизни ответов в SQLite-кэше (24 часа)
+MODELS_CACHE_FILE = os.path.join("cache", "models.json")  # Дисковый кэш списка моделей
+MODELS_TTL = 86400                                 # Срок жизни кэша моделей (24 часа)
+BALANCE_TTL = 30                                   # Срок жизни кэша баланса в секундах
+
+# Резервный список популярных моделей (на случай отсутствия интернета или ошибки API)
+DEFAULT_MODELS = [
+    {"id": "openchat/openchat-3.5", "name": "OpenChat"},
+    {"id": "google/gemma-2-27b-it", "name": "Gemma 2 27B"},
+    {"id": "mistralai/mixtral-8x22b-instruct", "name": "Mixtral 8x22B"},
+    {"id": "anthropic/claude-3.5-sonnet", "name": "Claude 3.5 Sonnet"},
+    {"id": "openai/gpt-4o-mini", "name": "GPT-4o Mini"}
+]
+
+_ENV_LOADED = False                                # Признак того, что .env уже прочитан
+
+def _ensure_env():
+    """
+    Однократная загрузка переменных из .env.
+    
+    Повторные вызовы не обращаются к файловой системе.
+    """
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        load_dotenv()
+        _ENV_LOADED = True
+
 
 class OpenRouterClient:
     """
@@ -14,16 +46,19 @@ class OpenRouterClient:
     - Получение списка доступных моделей
     - Отправку сообщений выбранной модели
     - Получение текущего баланса аккаунта
+    - Кэширование ответов на повторяющиеся запросы (в памяти и в SQLite)
     - Автоматическую обработку ошибок авторизации (401)
     """
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None):
         """
         Инициализация клиента.
         
         Args:
             api_key (str, optional): API-ключ (может быть передан напрямую или взят из .env)
+            cache (ChatCache, optional): Хранилище для долговременного кэша ответов
         """
         self.logger = AppLogger()
+        _ensure_env()                                  # BASE_URL берётся из .env даже при явном ключе
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         self.base_url = os.getenv("BASE_URL", "https://openrouter.ai/api/v1")
 
@@ -35,10 +70,72 @@ class OpenRouterClient:
             "Content-Type": "application/json"
         }
 
+        # Постоянный асинхронный клиент: HTTP/2 и пул соединений избавляют от TLS-рукопожатия
+        # на каждом запросе и позволяют выполнять несколько запросов одновременно
+        self.aclient = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+
+        self._models = None                            # Список моделей, загружается лениво
+        self.cache = cache
+        self._response_cache = OrderedDict()           # LRU-кэш ответов в памяти
+        self._balance_cache = (None, 0)                # Последний баланс и время его получения
         self.logger.info("OpenRouterClient initialized successfully")
-        self.available_models = self.get_models()      # Загружаем модели сразу при инициализации
 
-    def get_models(self):
+    @property
+    def available_models(self):
+        """
+        Список моделей из памяти или дискового кэша.
+        
+        Returns:
+            list: Список словарей с id и name моделей или None,
+                  если кэш отсутствует или устарел (нужен refresh_models())
+        """
+        if self._models is None:
+            self._models = self._load_models_from_disk()
+        return self._models
+
+    def _load_models_from_disk(self):
+        """
+        Чтение списка моделей из дискового кэша, если он моложе MODELS_TTL.
+        """
+        try:
+            if time.time() - os.path.getmtime(MODELS_CACHE_FILE) > MODELS_TTL:
+                return None
+            with open(MODELS_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_models_to_disk(self, models: list):
+        """
+        Запись списка моделей в дисковый кэш.
+        """
+        try:
+            os.makedirs(os.path.dirname(MODELS_CACHE_FILE), exist_ok=True)
+            with open(MODELS_CACHE_FILE, 'w', encoding='utf-8') as f:
+                json.dump(models, f, ensure_ascii=False)
+        except OSError as e:
+            self.logger.warning(f"Failed to save models cache: {e}")
+
+    async def refresh_models(self):
+        """
+        Загрузка актуального списка моделей через API и обновление кэша.
+        
+        Returns:
+            list: Список словарей с id и name моделей
+        """
+        models = await self.get_models()
+        self._models = models
+        if models is not DEFAULT_MODELS:           # Резервный список на диск не сохраняем
+            self._save_models_to_disk(models)
+        return models
+
+    async def get_models(self):
         """
         Получение списка доступных моделей через API.
         
@@ -47,23 +144,16 @@ class OpenRouterClient:
         """
         self.logger.debug("Fetching available models")
         try:
-            response = requests.get(f"{self.base_url}/models", headers=self.headers)
+            response = await self.aclient.get("/models", timeout=10)
             response.raise_for_status()            # Вызовет исключение при 401/403/5xx
             models_data = response.json()
             self.logger.info(f"Retrieved {len(models_data['data'])} models")
             return [{"id": m["id"], "name": m["name"]} for m in models_data["data"]]
         except Exception as e:
             self.logger.warning(f"Failed to fetch models, using defaults: {e}")
-            # Резервный список популярных моделей (на случай отсутствия интернета или ошибки API)
-            return [
-                {"id": "openchat/openchat-3.5", "name": "OpenChat"},
-                {"id": "google/gemma-2-27b-it", "name": "Gemma 2 27B"},
-                {"id": "mistralai/mixtral-8x22b-instruct", "name": "Mixtral 8x22B"},
-                {"id": "anthropic/claude-3.5-sonnet", "name": "Claude 3.5 Sonnet"},
-                {"id": "openai/gpt-4o-mini", "name": "GPT-4o Mini"}
-            ]
+            return DEFAULT_MODELS
 
-    def send_message(self, message: str, model: str):
+    async def send_message(self, message: str, model: str):
         """
         Отправка сообщения выбранной модели.
         
@@ -72,33 +162,92 @@ class OpenRouterClient:
             model (str): ID выбранной модели
         
         Returns:
-            dict: Ответ от API в формате OpenAI
+            dict: Ответ от API в формате OpenAI. Ответ из кэша помечен ключом
+                  "cached": True — токены на него не тратились
         """
+        key = hashlib.sha256(f"{model}\0{message}".encode()).hexdigest()
+
+        # Сначала проверяем кэш в памяти, затем SQLite (в отдельном потоке,
+        # чтобы ожидание блокировки базы не останавливало цикл событий)
+        if key in self._response_cache:
+            self._response_cache.move_to_end(key)
+            self.logger.debug("Response cache hit (memory)")
+            return {**self._response_cache[key], "cached": True}
+        if self.cache:
+            cached = await asyncio.to_thread(self.cache.get_cached_response, key, RESPONSE_CACHE_TTL)
+            if cached is not None:
+                self.logger.debug("Response cache hit (db)")
+                self._remember_response(key, cached)
+                return {**cached, "cached": True}
+
         data = {
             "model": model,
             "messages": [{"role": "user", "content": message}]
         }
         try:
-            response = requests.post(f"{self.base_url}/chat/completions", headers=self.headers, json=data)
+            response = await self.aclient.post("/chat/completions", json=data)
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            if "error" not in result:
+                self._remember_response(key, result)
+                if self.cache:
+                    try:
+                        await asyncio.to_thread(self.cache.save_cached_response, key, result, RESPONSE_CACHE_TTL)
+                    except Exception as e:
+                        self.logger.warning(f"Failed to save response cache: {e}")
+            return result
         except Exception as e:
             self.logger.error(f"API request failed: {e}", exc_info=True)
             return {"error": str(e)}
 
-    def get_balance(self):
+    def clear_response_cache(self):
+        """
+        Очистка кэша ответов в памяти (например, после удаления истории).
+        """
+        self._response_cache.clear()
+
+    def _remember_response(self, key: str, result: dict):
+        """
+        Сохранение ответа в LRU-кэше в памяти с вытеснением самых старых записей.
+        """
+        self._response_cache[key] = result
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
+    async def get_balance(self):
         """
         Получение текущего баланса аккаунта.
         
+        Успешный результат кэшируется на BALANCE_TTL секунд.
+        
         Returns:
             str: Остаток средств в формате $X.XX или "н/д"
         """
+        balance, ts = self._balance_cache
+        if balance is not None and time.time() - ts < BALANCE_TTL:
+            return balance
         try:
-            response = requests.get(f"{self.base_url}/credits", headers=self.headers)
+            response = await self.aclient.get("/credits", timeout=10)
             response.raise_for_status()
             data = response.json().get('data', {})
             remaining = data.get('total_credits', 0) - data.get('total_usage', 0)
-            return f"${remaining:.2f}"
+            balance = f"${remaining:.2f}"
+            self._balance_cache = (balance, time.time())
+            return balance
         except Exception as e:
             self.logger.warning(f"Failed to get balance: {e}")
-            return "н/д"
\ No newline at end of file
+            return "н/д"
+
+    def invalidate_balance(self):
+        """
+        Сброс кэша баланса (вызывается после отправки сообщения).
+        """
+        self._balance_cache = (None, 0)
+
+    async def close(self):
+        """
+        Закрытие HTTP-клиента и освобождение пула соединений.
+        """
+        await self.aclient.aclose()
+        self.logger.info("OpenRouterClient closed")
@@ -10,9 +10,12 @@ from utils.monitor import PerformanceMonitor       # Модуль для мон
 import asyncio                                     # Библиотека для асинхронного выполнения запросов к API
 import time                                        # Библиотека для измерения времени ответа модели
 import os                                          # Библиотека для работы с файловой системой (создание папки exports)
-import random                                      # Библиотека для генерации случайного 4-значного PIN-кода
+import secrets                                     # Криптостойкая генерация случайного 4-значного PIN-кода
 from datetime import datetime                      # Класс для работы с датой и временем (имена файлов, таймстампы)
-import json                                        # Библиотека для сохранения истории чата в JSON-формате
+import orjson                                      # Быстрая сериализация истории чата в JSON-формат
+
+
+HISTORY_PAGE_SIZE = 50                             # Количество сообщений, подгружаемых за один раз
 
 
 class ChatApp:
@@ -46,6 +49,9 @@ class ChatApp:
         self.balance_text = None
         self.model_dropdown = None
         self.chat_history = None
+        self.oldest_history_id = None              # id самого старого показанного сообщения
+        self.history_exhausted = False             # Вся история уже загружена
+        self.history_loading = False               # Идёт подгрузка более старой страницы
         self.message_input = None
 
     def main(self, page: ft.Page):
@@ -58,17 +64,43 @@ class ChatApp:
         self.page = page
         
         # Применение глобальных стилей страницы
-        for key, value in AppStyles.PAGE_SETTINGS.items():
-            setattr(page, key, value)
-        AppStyles.set_window_size(page)
+        AppStyles.apply_page_style(page)
         page.title = "OpenRouter Chat"
 
+        # Перехват закрытия окна для корректного освобождения ресурсов
+        page.window.prevent_close = True
+        page.window.on_event = self.handle_window_event
+
         # Выбор экрана в зависимости от наличия сохранённого ключа/PIN
         if not self.stored_api_key or not self.stored_pin:
             self.show_key_entry_screen()       # Первый запуск
         else:
             self.show_pin_entry_screen()       # Повторный запуск
 
+    async def handle_window_event(self, e):
+        """
+        Обработка событий окна приложения.
+        
+        При закрытии окна закрывает HTTP-клиент API, дописывает в базу
+        накопленные записи и уничтожает окно. Окно уничтожается,
+        даже если освобождение ресурсов завершилось ошибкой.
+        
+        Args:
+            e: Событие окна
+        """
+        if e.data == "close":
+            try:
+                try:
+                    if self.api_client:
+                        await self.api_client.close()
+                except Exception as ex:
+                    self.logger.error(f"Ошибка закрытия клиента API: {ex}")
+                self.cache.close()
+            except Exception as ex:
+                self.logger.error(f"Ошибка закрытия кэша: {ex}")
+            finally:
+                self.page.window.destroy()
+
     # Универсальная функция закрытия любого диалогового окна (аналитика, очистка, сохранение)
     def close_dialog(self):
         """
@@ -109,15 +141,12 @@ class ChatApp:
 
             try:
                 # Создаём временный клиент для проверки ключа
-                temp_client = OpenRouterClient(api_key=api_key)
+                temp_client = OpenRouterClient(api_key=api_key, cache=self.cache)
 
                 # Генерируем случайный 4-значный PIN
-                new_pin = f"{random.randint(0, 9999):04d}"
-                self.cache.set_api_key_and_pin(api_key, new_pin)
-
-                # Сохраняем данные для текущей сессии
-                self.stored_api_key = api_key
-                self.stored_pin = new_pin
+                new_pin = f"{secrets.randbelow(10000):04d}"
+                # Сохраняем данные для текущей сессии в том виде, в каком они записаны в базу
+                self.stored_api_key, self.stored_pin = self.cache.set_api_key_and_pin(api_key, new_pin)
                 self.api_client = temp_client
 
                 # Переходим к экрану показа PIN-кода
@@ -169,7 +198,7 @@ class ChatApp:
                 ft.Text("При следующих запусках вы будете входить только по этому PIN.", size=16, color=ft.Colors.WHITE70, text_align=ft.TextAlign.CENTER),
                 ft.ElevatedButton(
                     "Запомнил → Открыть чат",
-                    on_click=lambda _: self.open_main_app(),  # Переход к основному чату
+                    on_click=lambda _: self.page.run_task(self.open_main_app),  # Переход к основному чату
                     width=420,
                     height=60,
                     style=ft.ButtonStyle(bgcolor=ft.Colors.GREEN_600, color=ft.Colors.WHITE)
@@ -196,12 +225,12 @@ class ChatApp:
         )
         error_text = ft.Text("", color=ft.Colors.RED_600, size=14)
 
-        def check_pin(e):
+        async def check_pin(e):
             """Проверка введённого PIN-кода и открытие чата при успехе"""
             if pin_input.value == self.stored_pin:
                 try:
-                    self.api_client = OpenRouterClient(api_key=self.stored_api_key)
-                    self.open_main_app()
+                    self.api_client = OpenRouterClient(api_key=self.stored_api_key, cache=self.cache)
+                    await self.open_main_app()
                 except:
                     error_text.value = "Ключ больше не валиден"
                     self.page.update()
@@ -230,7 +259,7 @@ class ChatApp:
         )
         self.page.update()
 
-    def open_main_app(self):
+    async def open_main_app(self):
         """
         Переход к основному интерфейсу чата после успешной аутентификации.
         Полностью очищает страницу и восстанавливает оригинальные стили.
@@ -240,30 +269,27 @@ class ChatApp:
         self.page.dialog = None
         
         # Восстановление оригинальных стилей страницы из AppStyles
-        for key, value in AppStyles.PAGE_SETTINGS.items():
-            setattr(self.page, key, value)
-        AppStyles.set_window_size(self.page)
+        AppStyles.apply_page_style(self.page)
         self.page.update()
 
         self.build_chat_interface()                # Сборка основного интерфейса
         self.page.update()
+        self.scroll_history_to_end()               # Показываем последние сообщения
+        self.page.run_task(self.load_startup_data) # Модели и баланс подгружаются после отрисовки чата
 
     def build_chat_interface(self):
         """
         Сборка основного интерфейса чата.
         Вызывается только после успешного входа.
         """
-        # Загрузка моделей и установка первой по умолчанию
-        models = self.api_client.available_models
-        self.model_dropdown = ModelSelector(models)
-        self.model_dropdown.value = models[0]['id'] if models else None
+        # Загрузка моделей из кэша; если кэша нет — они подгрузятся в load_startup_data
+        self.model_dropdown = ModelSelector(self.api_client.available_models)
 
         # Отображение баланса
         self.balance_text = ft.Text("Баланс: Загрузка...", **AppStyles.BALANCE_TEXT)
-        self.update_balance()
 
         # История чата
-        self.chat_history = ft.ListView(**AppStyles.CHAT_HISTORY)
+        self.chat_history = ft.ListView(on_scroll=self.on_history_scroll, **AppStyles.CHAT_HISTORY)
         self.load_chat_history()
 
         # Поле ввода сообщения
@@ -273,14 +299,15 @@ class ChatApp:
             """Асинхронная отправка сообщения и получение ответа от модели"""
             if not self.message_input.value.strip():
                 return
+            # Список моделей ещё загружается — модель не выбрана, текст остаётся в поле ввода
+            if not self.model_dropdown.value:
+                return
             try:
                 self.message_input.border_color = ft.Colors.BLUE_400
-                self.page.update()
 
                 start_time = time.time()
                 user_message = self.message_input.value
                 self.message_input.value = ""
-                self.page.update()
 
                 # Добавляем сообщение пользователя
                 self.chat_history.controls.append(MessageBubble(message=user_message, is_user=True))
@@ -288,14 +315,13 @@ class ChatApp:
                 # Индикатор загрузки
                 loading = ft.ProgressRing(width=20, height=20)
                 self.chat_history.controls.append(loading)
-                self.page.update()
+
+                # Одно обновление поля ввода и истории перед ожиданием ответа
+                self.page.update(self.message_input, self.chat_history)
+                self.scroll_history_to_end()
 
                 # Асинхронный запрос к API
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.api_client.send_message(user_message, self.model_dropdown.value)
-                )
+                response = await self.api_client.send_message(user_message, self.model_dropdown.value)
 
                 # Убираем индикатор загрузки
                 self.chat_history.controls.remove(loading)
@@ -307,7 +333,8 @@ class ChatApp:
                     self.logger.error(f"API Error: {response['error']}")
                 else:
                     response_text = response["choices"][0]["message"]["content"]
-                    tokens_used = response.get("usage", {}).get("total_tokens", 0)
+                    # Ответ из кэша не расходовал токены — не учитываем их повторно
+                    tokens_used = 0 if response.get("cached") else response.get("usage", {}).get("total_tokens", 0)
 
                 # Сохраняем сообщение в базу
                 self.cache.save_message(
@@ -330,12 +357,18 @@ class ChatApp:
                 )
 
                 self.monitor.log_metrics(self.logger)
-                self.page.update()
+                self.page.update(self.chat_history)    # Одно обновление после получения ответа
+                self.scroll_history_to_end()
+
+                # Баланс изменился после запроса — сбрасываем кэш и обновляем
+                if "error" not in response and not response.get("cached"):
+                    self.api_client.invalidate_balance()
+                    await self.update_balance()
 
             except Exception as ex:
                 self.logger.error(f"Ошибка отправки сообщения: {ex}")
                 self.message_input.border_color = ft.Colors.RED_400
-                self.page.update()
+                self.page.update(self.message_input)
 
         def show_analytics(e):
             """Открытие окна аналитики использования приложения"""
@@ -361,8 +394,10 @@ class ChatApp:
         def clear_chat_data():
             """Полная очистка истории чата и аналитики"""
             self.cache.clear_history()
+            self.api_client.clear_response_cache()
             self.analytics.clear_data()
             self.chat_history.controls.clear()
+            self.history_exhausted = True
             self.page.update()
 
         def confirm_clear_history(e):
@@ -389,7 +424,7 @@ class ChatApp:
                 dialog_data = []
                 for msg in history:
                     dialog_data.append({
-                        "timestamp": str(msg[4]),
+                        "timestamp": str(datetime.fromtimestamp(msg[4] / 1000)),
                         "model": msg[1],
                         "user_message": msg[2],
                         "ai_response": msg[3],
@@ -400,9 +435,9 @@ class ChatApp:
                 filename = f"chat_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
                 filepath = os.path.join(self.exports_dir, filename)
 
-                # Записываем в файл
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(dialog_data, f, ensure_ascii=False, indent=2, default=str)
+                # Записываем в файл (orjson сразу выдаёт UTF-8 байты)
+                with open(filepath, 'wb') as f:
+                    f.write(orjson.dumps(dialog_data, option=orjson.OPT_INDENT_2, default=str))
 
                 # Окно успешного сохранения
                 dlg = ft.AlertDialog(
@@ -453,32 +488,108 @@ class ChatApp:
         self.monitor.get_metrics()
         self.logger.info("Чат открыт успешно")
 
-    def update_balance(self):
+    async def load_startup_data(self):
+        """Параллельная загрузка баланса и списка моделей (если его нет в кэше)"""
+        tasks = [self.update_balance()]
+        if self.api_client.available_models is None:
+            tasks.append(self.refresh_models())
+        await asyncio.gather(*tasks)
+
+    async def refresh_models(self):
+        """Фоновая загрузка списка моделей и обновление выпадающего списка"""
+        models = await self.api_client.refresh_models()
+        self.model_dropdown.set_models(models)
+        self.page.update()
+
+    async def update_balance(self):
         """Обновление отображения баланса аккаунта OpenRouter"""
         if not self.api_client:
             return
         try:
-            balance = self.api_client.get_balance()
+            balance = await self.api_client.get_balance()
             self.balance_text.value = f"Баланс: {balance}"
             self.balance_text.color = ft.Colors.GREEN_400
         except:
             self.balance_text.value = "Баланс: н/д"
             self.balance_text.color = ft.Colors.RED_400
-        self.page.update()
+        self.page.update(self.balance_text)
 
     def load_chat_history(self):
-        """Загрузка сохранённой истории чата из базы данных при запуске"""
+        """
+        Загрузка последней страницы истории чата из базы данных при запуске.
+        
+        Пузырьки собираются в обычный список и присваиваются ListView одним действием;
+        отрисовка происходит единственным page.update() в open_main_app.
+        Более старые сообщения подгружаются при прокрутке к началу (on_history_scroll).
+        """
         try:
-            history = self.cache.get_chat_history()
-            for msg in reversed(history):
-                _, model, user_message, ai_response, timestamp, tokens = msg
-                self.chat_history.controls.extend([
-                    MessageBubble(message=user_message, is_user=True),
-                    MessageBubble(message=ai_response, is_user=False)
-                ])
+            self.oldest_history_id = None
+            self.history_exhausted = False
+            self.chat_history.controls = self.load_history_page(self.fetch_history_page(None))
         except Exception as e:
             self.logger.error(f"Ошибка загрузки истории: {e}")
 
+    def fetch_history_page(self, before_id):
+        """
+        Чтение из базы страницы истории, предшествующей сообщению before_id.
+        
+        Не трогает интерфейс и состояние окна, поэтому может выполняться в отдельном потоке.
+        
+        Args:
+            before_id (int): id самого старого показанного сообщения (None — последняя страница)
+        
+        Returns:
+            list: Строки сообщений в хронологическом порядке
+        """
+        return list(self.cache.iter_chat_history(HISTORY_PAGE_SIZE, before_id))
+
+    def load_history_page(self, rows):
+        """
+        Построение пузырьков для страницы истории и обновление позиции подгрузки.
+        
+        Args:
+            rows (list): Строки страницы из fetch_history_page
+        
+        Returns:
+            list: Пузырьки сообщений страницы в хронологическом порядке
+        """
+        bubbles = []
+        for row in rows:
+            bubbles.append(MessageBubble(message=row["user_message"], is_user=True))
+            bubbles.append(MessageBubble(message=row["ai_response"], is_user=False))
+        if rows:
+            self.oldest_history_id = rows[0]["id"]
+        self.history_exhausted = len(rows) < HISTORY_PAGE_SIZE
+        return bubbles
+
+    def scroll_history_to_end(self):
+        """Прокрутка истории к последнему сообщению (автопрокрутка списка отключена)"""
+        self.chat_history.scroll_to(offset=-1, duration=300)
+
+    async def on_history_scroll(self, e):
+        """
+        Подгрузка более старых сообщений при прокрутке истории к началу.
+        
+        Обработчик асинхронный: список сообщений меняется только в цикле событий,
+        как и в send_message_click. В отдельный поток вынесено лишь чтение из базы.
+        """
+        if (self.history_exhausted or self.history_loading
+                or e.event_type != "end" or e.pixels > e.min_scroll_extent):
+            return
+        self.history_loading = True
+        try:
+            rows = await asyncio.to_thread(self.fetch_history_page, self.oldest_history_id)
+            if self.history_exhausted:
+                return                             # История очищена, пока шло чтение
+            bubbles = self.load_history_page(rows)
+            if bubbles:
+                self.chat_history.controls[:0] = bubbles
+                self.page.update(self.chat_history)
+        except Exception as ex:
+            self.logger.error(f"Ошибка загрузки истории: {ex}")
+        finally:
+            self.history_loading = False
+
 
 def main():
     """Точка входа в приложение"""
@@ -2,7 +2,6 @@
 import flet as ft  # Основной фреймворк для создания GUI
 from api import OpenRouterClient  # Клиент для работы с API OpenRouter
 from ui import MessageBubble  # Компонент для отображения сообщений
-import asyncio  # Библиотека для асинхронного программирования
 
 class SimpleChatApp:
     def __init__(self):
@@ -62,14 +61,7 @@ class SimpleChatApp:
             page.update()
 
             # Асинхронная отправка запроса к API
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.api_client.send_message(
-                    user_message, 
-                    "openai/gpt-3.5-turbo"
-                )
-            )
+            response = await self.api_client.send_message(user_message, "openai/gpt-3.5-turbo")
 
             # Удаление индикатора загрузки
             self.chat_history.controls.remove(loading)
@@ -82,7 +82,28 @@ class ModelSelector(ft.Dropdown):
             
         # Настройка внешнего вида выпадающего списка
         self.label = None                    # Убираем текстовую метку
-        self.hint_text = "Выбор модели"      # Текст-подсказка
+        
+        # Заполнение списка опций из предоставленных моделей
+        self.set_models(models)
+        
+        # Создание поля поиска для фильтрации моделей
+        self.search_field = ft.TextField(
+            on_change=self.filter_options,        # Функция обработки изменений
+            hint_text="Поиск модели",            # Текст-подсказка в поле поиска
+            **AppStyles.MODEL_SEARCH_FIELD       # Применение стилей из конфигурации
+        )
+
+    def set_models(self, models):
+        """
+        Заполнение списка опций моделями.
+        
+        Args:
+            models (list): Список моделей или None, пока список ещё загружается
+        """
+        models = models or []
+        
+        # Пока модели не загружены, показываем подсказку о загрузке
+        self.hint_text = "Выбор модели" if models else "Загрузка моделей…"
         
         # Создание списка опций из предоставленных моделей
         self.options = [
@@ -97,13 +118,6 @@ class ModelSelector(ft.Dropdown):
         
         # Установка начального значения (первая модель из списка)
         self.value = models[0]['id'] if models else None
-        
-        # Создание поля поиска для фильтрации моделей
-        self.search_field = ft.TextField(
-            on_change=self.filter_options,        # Функция обработки изменений
-            hint_text="Поиск модели",            # Текст-подсказка в поле поиска
-            **AppStyles.MODEL_SEARCH_FIELD       # Применение стилей из конфигурации
-        )
 
     def filter_options(self, e):
         """
@@ -27,7 +27,7 @@ class AppStyles:
         "expand": True,       # Разрешаем расширение на все доступное пространство
         "spacing": 10,        # Отступ между сообщениями в пикселях
         "height": 400,        # Фиксированная высота области чата
-        "auto_scroll": True,  # Автоматическая прокрутка к новым сообщениям
+        "auto_scroll": False, # Без автопрокрутки: подгрузка старых сообщений не сбрасывает позицию
         "padding": 20,        # Внутренние отступы области чата
     }
 
@@ -184,6 +184,21 @@ class AppStyles:
         "border": ft.border.all(1, ft.Colors.GREY_700),  # Тонкая серая граница
     }
 
+    @staticmethod
+    def apply_page_style(page: ft.Page):
+        """
+        Применение PAGE_SETTINGS и размера окна к странице
+        
+        Все ключи PAGE_SETTINGS — свойства Flet с сеттерами, которые передают
+        изменения клиенту, поэтому они устанавливаются через setattr, а не через __dict__
+        
+        Args:
+            page (ft.Page): Объект страницы приложения
+        """
+        for key, value in AppStyles.PAGE_SETTINGS.items():
+            setattr(page, key, value)
+        AppStyles.set_window_size(page)
+
     @staticmethod
     def set_window_size(page: ft.Page):
         """
@@ -55,7 +55,7 @@ class Analytics:
             
             # Добавление в сессионные данные
             self.session_data.append({
-                'timestamp': datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f'),
+                'timestamp': datetime.fromtimestamp(timestamp / 1000),
                 'model': model,
                 'message_length': message_length,
                 'response_time': response_time,
@@ -78,7 +78,7 @@ class Analytics:
         timestamp = datetime.now()
         
         # Сохранение в базу данных
-        self.cache.save_analytics(timestamp, model, message_length, response_time, tokens_used)
+        self.cache.save_analytics(int(timestamp.timestamp() * 1000), model, message_length, response_time, tokens_used)
         
         # Инициализация статистики для новой модели при первом использовании
         if model not in self.model_usage:
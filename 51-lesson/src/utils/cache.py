@@ -1,15 +1,113 @@
 # Импорт необходимых библиотек
+import os                                          # Число процессоров для размера пула соединений
 import sqlite3                                     # Библиотека для работы с SQLite базой данных
-from datetime import datetime                      # Класс для работы с датой и временем
 import threading                                   # Библиотека для потокобезопасной работы с базой
+import queue                                       # Очередь записей для единственного потока-писателя
+import logging                                     # Журнал ошибок фоновой записи (логгер приложения ChatApp)
+import orjson                                      # Быстрая сериализация ответов API для кэша
+import time                                        # Временные метки для срока жизни кэша ответов
+from contextlib import contextmanager              # Выдача соединения из пула через with
+from itertools import chain                        # Разворачивание строк в плоский список параметров
+
+SQLITE_MAX_VARIABLES = 500                         # Безопасный лимит параметров в одном SQL-запросе
+SQLITE_CACHED_STATEMENTS = 256                     # Размер кэша подготовленных запросов на соединение
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024               # Объём файла базы, читаемый через mmap (256 МБ)
+SCHEMA_VERSION = 3                                 # Версия схемы базы (хранится в PRAGMA user_version)
+POOL_SIZE = 2 * (os.cpu_count() or 1)              # Максимум открытых соединений в пуле
+WRITE_QUEUE_SIZE = 10_000                          # Максимум записей, ожидающих потока-писателя
+WRITE_BATCH_SIZE = 500                             # Максимум записей в одной транзакции писателя
+WRITE_BATCH_INTERVAL = 0.05                        # Время накопления пачки записей в секундах
+WRITE_RETRY_DELAY = 0.1                            # Начальная пауза перед повтором записи при занятой базе
+WRITE_RETRY_MAX_DELAY = 5.0                        # Максимальная пауза между повторами записи
+ANALYTICS_FLUSH_INTERVAL = 2.0                     # Период сброса буфера аналитики на диск в секундах
+
+# Текущее время в миллисекундах Unix, вычисляемое самим SQLite
+_SQL_NOW_MS = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Схемы таблиц с временем в виде INTEGER (миллисекунды Unix)
+_SQL_CREATE_MESSAGES = f'''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model TEXT,
+        user_message TEXT,
+        ai_response TEXT,
+        timestamp INTEGER DEFAULT ({_SQL_NOW_MS}),
+        tokens_used INTEGER
+    )
+'''
+# Для аналитики id — просто rowid: без AUTOINCREMENT вставка не обновляет sqlite_sequence
+_SQL_CREATE_ANALYTICS = '''
+    CREATE TABLE IF NOT EXISTS analytics_messages (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER,
+        model TEXT,
+        message_length INTEGER,
+        response_time FLOAT,
+        tokens_used INTEGER
+    )
+'''
+
+# Таблицы истории и их индексы: создаются в create_tables и пересоздаются в clear_history.
+# Индексы по времени позволяют сортировать историю и аналитику без полного сканирования
+_SQL_HISTORY_SCHEMA = (
+    _SQL_CREATE_MESSAGES,
+    _SQL_CREATE_ANALYTICS,
+    "CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(timestamp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_analytics_ts ON analytics_messages(timestamp ASC)",
+)
+
+# Перевод локального текстового DATETIME в миллисекунды Unix (для миграции старых баз)
+_SQL_DATETIME_TO_MS = "CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Столбцы, заполняемые при вставке, для каждой таблицы
+_TABLE_COLUMNS = {
+    'messages': ('model', 'user_message', 'ai_response', 'timestamp', 'tokens_used'),
+    'analytics_messages': ('timestamp', 'model', 'message_length', 'response_time', 'tokens_used'),
+}
+
+# Столбцы одиночного сообщения: timestamp заполняет DEFAULT на стороне SQLite
+_MESSAGE_COLUMNS = ('model', 'user_message', 'ai_response', 'tokens_used')
+
+# Запросы горячего пути: одинаковые строки попадают в кэш подготовленных запросов sqlite3
+_SQL_SELECT_HISTORY = '''
+    SELECT id, model, user_message, ai_response, timestamp, tokens_used FROM messages
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+'''
+# Аналитика: WHERE добавляется, только если задана нижняя граница времени,
+# иначе "? IS NULL OR timestamp >= ?" не позволил бы искать по idx_analytics_ts
+_SQL_SELECT_ANALYTICS = '''
+    SELECT timestamp, model, message_length, response_time, tokens_used FROM analytics_messages
+'''
+_SQL_WHERE_ANALYTICS_SINCE = "WHERE timestamp >= ?"
+# Первая и последующие страницы истории — отдельные запросы: условие вида
+# "? IS NULL OR id < ?" не даёт SQLite искать по rowid и вызывает полный просмотр
+_SQL_SELECT_HISTORY_LAST_PAGE = '''
+    SELECT id, user_message, ai_response FROM (
+        SELECT id, user_message, ai_response FROM messages
+        ORDER BY id DESC
+        LIMIT ?
+    ) ORDER BY id ASC
+'''
+_SQL_SELECT_HISTORY_PAGE_BEFORE = '''
+    SELECT id, user_message, ai_response FROM (
+        SELECT id, user_message, ai_response FROM messages
+        WHERE id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ) ORDER BY id ASC
+'''
 
 class ChatCache:
     """
     Класс для кэширования истории чата и данных аутентификации в SQLite.
     
     Обеспечивает:
-    - Потокобезопасное хранение сообщений и аналитики
+    - Потокобезопасное хранение сообщений через единственный поток-писатель
+    - Буферизацию аналитики в памяти с периодическим сбросом на диск
     - Хранение API-ключа и PIN-кода
+    - Кэширование ответов API по точному совпадению запроса
+    - Кэширование в памяти часто читаемых данных (ключ/PIN, история)
     - Очистку истории и аутентификации
     """
     def __init__(self):
@@ -19,62 +117,226 @@ class ChatCache:
         Создаёт файл базы данных и необходимые таблицы.
         """
         self.db_name = 'chat_cache.db'
-        self.local = threading.local()         # Потокобезопасное хранилище соединений
+        self._pool = queue.LifoQueue(maxsize=POOL_SIZE)  # Свободные соединения (последнее возвращённое — первым)
+        self._pool_lock = threading.Lock()     # Защита счётчика открытых соединений
+        self._pool_opened = 0                  # Сколько соединений пула открыто
+        self._tx = threading.local()           # Соединение открытой в потоке транзакции
+        self._cache_lock = threading.RLock()   # Защита кэшей чтения в памяти
+        self._auth_cache = None                # Последний прочитанный (api_key, pin)
+        self._history_cache = {}               # Результаты get_chat_history по значению limit
+        self._analytics_buf = []               # Записи аналитики, ещё не сброшенные на диск
+        self._analytics_lock = threading.Lock()        # Защита буфера аналитики и таймера
+        self._analytics_flush_lock = threading.Lock()  # Не более одного сброса аналитики одновременно
+        self._analytics_timer = None           # Запланированный сброс буфера (threading.Timer)
         self.create_tables()
 
-    def get_connection(self):
+        # Все одиночные записи выполняет один фоновый поток пачками в одной транзакции
+        self._write_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._writer_loop, name="ChatCacheWriter", daemon=True)
+        self._writer.start()
+
+    def _open_connection(self):
         """
-        Получение соединения с базой для текущего потока.
+        Открытие и настройка нового соединения с базой.
         
         Returns:
-            sqlite3.Connection: Объект соединения
+            tuple: (sqlite3.Connection, sqlite3.Cursor) — соединение и его переиспользуемый курсор
+        """
+        conn = sqlite3.connect(
+            self.db_name,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            isolation_level=None               # Без неявных транзакций: только явные BEGIN/COMMIT
+        )
+        conn.row_factory = sqlite3.Row         # Доступ к столбцам по имени
+        self.apply_pragmas(conn)
+        return conn, conn.cursor()
+
+    @contextmanager
+    def connection(self):
+        """
+        Получение соединения из пула на время блока with.
+        
+        Соединения открываются по мере нужды, но не больше POOL_SIZE;
+        при исчерпании пула поток ждёт освобождения соединения.
+        Внутри transaction() выдаётся соединение этой транзакции.
+        Незавершённая транзакция откатывается перед возвратом в пул.
+        
+        Yields:
+            tuple: (sqlite3.Connection, sqlite3.Cursor)
+        """
+        entry = getattr(self._tx, 'entry', None)
+        if entry is not None:
+            yield entry
+            return
+        try:
+            entry = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_open = self._pool_opened < POOL_SIZE
+                if can_open:
+                    self._pool_opened += 1
+            if can_open:
+                try:
+                    entry = self._open_connection()
+                except Exception:
+                    with self._pool_lock:
+                        self._pool_opened -= 1
+                    raise
+            else:
+                entry = self._pool.get()
+        try:
+            yield entry
+        finally:
+            if entry[0].in_transaction:
+                entry[0].rollback()
+            self._pool.put(entry)
+
+    def _check_no_transaction(self, method):
+        """
+        Запрет вызова метода внутри transaction() текущего потока.
+        
+        Такие методы ждут поток-писатель или выполняют VACUUM и контрольную
+        точку WAL, что невозможно, пока открыта транзакция.
+        """
+        if getattr(self._tx, 'entry', None) is not None:
+            raise RuntimeError(f"ChatCache.{method}() cannot be called inside transaction()")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция BEGIN IMMEDIATE ... COMMIT на соединении из пула.
+        
+        В этой же транзакции выполняются вызванные внутри блока в том же потоке
+        save_messages_bulk, save_analytics_bulk, flush_analytics,
+        save_cached_response, set_api_key_and_pin, clear_auth и все чтения;
+        вложенный transaction() новую не открывает. При исключении выполняется ROLLBACK.
+        
+        save_message ставит запись в очередь писателя: она сохраняется после
+        завершения транзакции, и чтения внутри блока её не видят (flush() здесь
+        не ждёт). clear_history и close внутри транзакции запрещены (RuntimeError).
+        
+        Yields:
+            tuple: (sqlite3.Connection, sqlite3.Cursor)
         """
-        if not hasattr(self.local, 'connection'):
-            self.local.connection = sqlite3.connect(self.db_name, check_same_thread=False)
-        return self.local.connection
+        if getattr(self._tx, 'entry', None) is not None:
+            yield self._tx.entry
+            return
+        with self.connection() as entry:
+            conn, cursor = entry
+            cursor.execute("BEGIN IMMEDIATE")
+            self._tx.entry = entry
+            try:
+                yield entry
+            except BaseException:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                # Кэши в памяти могли получить данные из отменённой транзакции
+                with self._cache_lock:
+                    self._auth_cache = None
+                self._invalidate_history()
+                raise
+            else:
+                cursor.execute("COMMIT")
+            finally:
+                self._tx.entry = None
+
+    def apply_pragmas(self, conn):
+        """
+        Настройка соединения для быстрой записи.
+        
+        WAL позволяет читать во время записи, synchronous=NORMAL убирает
+        лишний fsync на каждую транзакцию. Для базы в памяти не применяется.
+        
+        Args:
+            conn (sqlite3.Connection): Настраиваемое соединение
+        """
+        if self.db_name == ':memory:':
+            return
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")   # 20 МБ кэша страниц
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")  # Чтение страниц без копирования в кучу
 
     def create_tables(self):
         """
         Создание всех необходимых таблиц в базе данных.
+        
+        Если версия схемы в базе уже текущая, DDL не выполняется.
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Таблица сообщений чата
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model TEXT,
-                user_message TEXT,
-                ai_response TEXT,
-                timestamp DATETIME,
-                tokens_used INTEGER
-            )
-        ''')
-
-        # Таблица аналитики
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME,
-                model TEXT,
-                message_length INTEGER,
-                response_time FLOAT,
-                tokens_used INTEGER
-            )
-        ''')
-
-        # Таблица аутентификации (ключ + PIN)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS auth (
-                id INTEGER PRIMARY KEY,
-                api_key TEXT NOT NULL,
-                pin TEXT NOT NULL
+        with self.connection() as (_, cursor):
+            # Быстрый путь: база уже создана текущей версией приложения
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        with self.transaction() as (conn, cursor):
+            # Приведение таблиц из баз старых версий к текущей схеме
+            self._migrate_tables(conn)
+
+            # Таблицы сообщений чата и аналитики с индексами
+            for ddl in _SQL_HISTORY_SCHEMA:
+                cursor.execute(ddl)
+
+            # Таблица аутентификации (ключ + PIN)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS auth (
+                    id INTEGER PRIMARY KEY,
+                    api_key TEXT NOT NULL,
+                    pin TEXT NOT NULL
+                )
+            ''')
+
+            # Таблица кэша ответов API (ключ — хэш модели и сообщения)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT,
+                    ts INTEGER
+                )
+            ''')
+
+            cursor.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _migrate_tables(self, conn):
+        """
+        Пересоздание таблиц, схема которых отличается от текущей.
+        
+        Таблица пересобирается, если её CREATE TABLE не совпадает с текущим
+        (без учёта пробелов). Текстовый DATETIME в timestamp при этом
+        переводится в миллисекунды Unix. Данные сохраняются.
+        
+        Args:
+            conn (sqlite3.Connection): Соединение с открытой транзакцией
+        """
+        tables = (
+            ('messages', _SQL_CREATE_MESSAGES, 'id, model, user_message, ai_response, {ts}, tokens_used'),
+            ('analytics_messages', _SQL_CREATE_ANALYTICS, 'id, {ts}, model, message_length, response_time, tokens_used'),
+        )
+        for table, ddl, columns in tables:
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if row is None:
+                continue                           # Таблицы ещё нет — будет создана по текущей схеме
+            if self._normalize_ddl(row[0]) == self._normalize_ddl(ddl):
+                continue
+            types = {info[1]: info[2] for info in conn.execute(f"PRAGMA table_info({table})")}
+            legacy_ts = types.get('timestamp', '').upper() == 'DATETIME'
+            ts = _SQL_DATETIME_TO_MS if legacy_ts else 'timestamp'
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            conn.execute(ddl)
+            conn.execute(
+                f"INSERT INTO {table} ({columns.format(ts='timestamp')}) "
+                f"SELECT {columns.format(ts=ts)} FROM {table}_old"
             )
-        ''')
+            conn.execute(f"DROP TABLE {table}_old")
 
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def _normalize_ddl(sql):
+        """
+        Приведение CREATE TABLE к виду для сравнения: без IF NOT EXISTS и лишних пробелов.
+        """
+        return " ".join(sql.replace("IF NOT EXISTS ", "").split())
 
     def save_message(self, model, user_message, ai_response, tokens_used):
         """
@@ -85,14 +347,193 @@ class ChatCache:
             user_message (str): Сообщение пользователя
             ai_response (str): Ответ модели
             tokens_used (int): Количество использованных токенов
+        
+        Запись ставится в очередь потока-писателя и не блокирует вызывающий поток.
+        """
+        self._write_q.put(('messages', _MESSAGE_COLUMNS, (model, user_message, ai_response, tokens_used)))
+
+    def save_messages_bulk(self, rows):
+        """
+        Сохранение нескольких сообщений в одной транзакции.
+        
+        Args:
+            rows (list): Кортежи (model, user_message, ai_response, timestamp, tokens_used),
+                         timestamp — миллисекунды Unix
+        """
+        self._bulk_insert('messages', rows)
+        self._invalidate_history()
+
+    def _invalidate_history(self):
+        """
+        Сброс кэша истории в памяти после изменения таблицы сообщений.
+        """
+        with self._cache_lock:
+            self._history_cache.clear()
+
+    def _bulk_insert(self, table, rows):
+        """
+        Вставка строк в таблицу в одной транзакции.
+        
+        Args:
+            table (str): Имя таблицы из _TABLE_COLUMNS
+            rows (list): Кортежи значений в порядке столбцов таблицы
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self.transaction() as (_, cursor):
+            self._insert_rows(cursor, table, _TABLE_COLUMNS[table], rows)
+
+    def _insert_rows(self, cursor, table, cols, rows):
+        """
+        Вставка строк многострочными INSERT ... VALUES (...), (...) в текущей транзакции.
+        
+        Строки разбиваются на части так, чтобы число параметров в запросе
+        не превышало SQLITE_MAX_VARIABLES.
+        
+        Args:
+            cursor (sqlite3.Cursor): Курсор с открытой транзакцией
+            table (str): Имя таблицы
+            cols (tuple): Заполняемые столбцы
+            rows (list): Кортежи значений в порядке cols
+        """
+        chunk = max(1, SQLITE_MAX_VARIABLES // len(cols))
+        placeholder = "(" + ", ".join("?" * len(cols)) + ")"
+        prefix = f"INSERT INTO {table} ({', '.join(cols)}) VALUES "
+        for start in range(0, len(rows), chunk):
+            part = rows[start:start + chunk]
+            cursor.execute(
+                prefix + ", ".join([placeholder] * len(part)),
+                list(chain.from_iterable(part))
+            )
+
+    def _writer_loop(self):
+        """
+        Цикл потока-писателя.
+        
+        Ждёт первую запись, затем в течение WRITE_BATCH_INTERVAL добирает до
+        WRITE_BATCH_SIZE записей и сохраняет их одной транзакцией.
+        Значение None в очереди завершает поток.
+        У писателя собственное соединение вне пула. Если база занята другим
+        соединением (busy/locked), пачка не теряется: запись повторяется
+        с растущей паузой. При прочих ошибках пачка пропускается с записью в журнал.
+        """
+        logger = logging.getLogger('ChatApp')
+        conn = cursor = None
+        running = True
+        while running:
+            batch = [self._write_q.get()]
+            deadline = time.monotonic() + WRITE_BATCH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._write_q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            items = [item for item in batch if item is not None]
+            running = len(items) == len(batch)
+            delay = WRITE_RETRY_DELAY
+            try:
+                while True:
+                    try:
+                        if items and conn is None:
+                            conn, cursor = self._open_connection()
+                        self._write_batch(conn, cursor, items)
+                        break
+                    except sqlite3.OperationalError as e:
+                        if not self._is_busy_error(e):
+                            raise
+                        logger.warning(f"Cache database is busy, retrying batch in {delay:.1f}s: {e}")
+                        time.sleep(delay)
+                        delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+            except Exception:
+                logger.exception("Failed to write cache batch")
+            finally:
+                # task_done вызывается всегда, иначе flush() ждал бы вечно
+                for _ in batch:
+                    self._write_q.task_done()
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _is_busy_error(error):
+        """
+        Проверка, что ошибка SQLite временная: база занята или заблокирована другим соединением.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (model, user_message, ai_response, timestamp, tokens_used)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (model, user_message, ai_response, datetime.now(), tokens_used))
-        conn.commit()
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+
+    def _write_batch(self, conn, cursor, items):
+        """
+        Сохранение пачки записей из очереди в одной транзакции.
+        
+        Args:
+            conn (sqlite3.Connection): Соединение потока-писателя
+            cursor (sqlite3.Cursor): Курсор этого соединения
+            items (list): Тройки (таблица, столбцы, кортеж значений)
+        """
+        if not items:
+            return
+        rows_by_table = {}
+        for table, cols, row in items:
+            rows_by_table.setdefault((table, cols), []).append(row)
+
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for (table, cols), rows in rows_by_table.items():
+                self._insert_rows(cursor, table, cols, rows)
+            cursor.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        finally:
+            if any(table == 'messages' for table, _ in rows_by_table):
+                self._invalidate_history()
+
+    def flush(self):
+        """
+        Ожидание записи всех данных, поставленных в очередь.
+        
+        Если поток-писатель уже остановлен, ждать некого — возврат сразу.
+        Внутри transaction() ожидание не выполняется: писатель не получит
+        блокировку записи, пока транзакция этого потока не завершится.
+        Записи остаются в очереди и сохраняются после её завершения.
+        """
+        if getattr(self._tx, 'entry', None) is not None:
+            return
+        if self._writer.is_alive():
+            self._write_q.join()
+
+    def close(self):
+        """
+        Запись оставшихся данных, остановка потока-писателя и закрытие
+        свободных соединений пула.
+        
+        Raises:
+            RuntimeError: Если вызван внутри transaction()
+        """
+        self._check_no_transaction('close')
+        try:
+            self.flush_analytics()
+        finally:
+            if self._writer.is_alive():
+                self._write_q.put(None)
+                self._writer.join()
+            while True:
+                try:
+                    conn, _ = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                with self._pool_lock:
+                    self._pool_opened -= 1
 
     def get_chat_history(self, limit=100):
         """
@@ -102,44 +543,212 @@ class ChatCache:
             limit (int): Максимальное количество сообщений
         
         Returns:
-            list: Список кортежей с данными сообщений
+            list: Список строк с данными сообщений (общий для всех вызовов,
+                  не изменять)
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM messages 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
-        return cursor.fetchall()
+        self.flush()                           # Учитываем сообщения, ещё стоящие в очереди
+        with self._cache_lock:
+            history = self._history_cache.get(limit)
+            if history is None:
+                with self.connection() as (_, cursor):
+                    cursor.execute(_SQL_SELECT_HISTORY, (limit,))
+                    history = self._history_cache[limit] = cursor.fetchall()
+            return history
+
+    def iter_chat_history(self, limit=50, before_id=None):
+        """
+        Потоковое чтение страницы сообщений в хронологическом порядке.
+        
+        Строки отдаются по мере чтения из курсора, без построения полного списка.
+        Выбираются только поля, нужные для отображения чата.
+        
+        Args:
+            limit (int): Размер страницы
+            before_id (int, optional): Вернуть сообщения старше указанного id
+                                       (None — самые последние)
+        
+        Yields:
+            sqlite3.Row: Строка с полями id, user_message и ai_response (от старых к новым)
+        """
+        # Соединение занято, пока генератор не дочитан или не закрыт. Курсор отдельный:
+        # внутри transaction() общий курсор соединения сбросили бы другие запросы
+        with self.connection() as (conn, _):
+            if before_id is None:
+                rows = conn.execute(_SQL_SELECT_HISTORY_LAST_PAGE, (limit,))
+            else:
+                rows = conn.execute(_SQL_SELECT_HISTORY_PAGE_BEFORE, (before_id, limit))
+            yield from rows
 
     def save_analytics(self, timestamp, model, message_length, response_time, tokens_used):
         """
         Сохранение данных аналитики.
+        
+        Args:
+            timestamp (int): Время сообщения в миллисекундах Unix
+            model (str): ID модели
+            message_length (int): Длина сообщения в символах
+            response_time (float): Время ответа в секундах
+            tokens_used (int): Количество использованных токенов
+        
+        Запись попадает в буфер в памяти и сохраняется на диск не позже чем
+        через ANALYTICS_FLUSH_INTERVAL секунд (или при flush_analytics/close).
+        """
+        with self._analytics_lock:
+            self._analytics_buf.append((timestamp, model, message_length, response_time, tokens_used))
+            self._arm_analytics_timer()
+
+    def _arm_analytics_timer(self):
+        """
+        Запуск таймера сброса аналитики, если он ещё не запущен.
+        
+        Вызывается под _analytics_lock. Таймер взводится первой записью
+        после сброса: без данных поток не просыпается.
+        """
+        if self._analytics_timer is None:
+            self._analytics_timer = threading.Timer(ANALYTICS_FLUSH_INTERVAL, self._flush_analytics_on_timer)
+            self._analytics_timer.daemon = True
+            self._analytics_timer.start()
+
+    def save_analytics_bulk(self, rows):
+        """
+        Сохранение нескольких записей аналитики в одной транзакции.
+        
+        Args:
+            rows (list): Кортежи (timestamp, model, message_length, response_time, tokens_used),
+                         timestamp — миллисекунды Unix
+        """
+        self._bulk_insert('analytics_messages', rows)
+
+    def flush_analytics(self):
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO analytics_messages 
-            (timestamp, model, message_length, response_time, tokens_used)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (timestamp, model, message_length, response_time, tokens_used))
-        conn.commit()
-
-    def get_analytics_history(self):
-        """Получение всей истории аналитики"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT timestamp, model, message_length, response_time, tokens_used FROM analytics_messages ORDER BY timestamp ASC')
-        return cursor.fetchall()
-
-    def clear_history(self):
-        """Полная очистка истории чата и аналитики"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages')
-        cursor.execute('DELETE FROM analytics_messages')
-        conn.commit()
+        Сохранение буфера аналитики на диск одной транзакцией.
+        
+        Вызывается таймером, перед чтением аналитики и при закрытии.
+        Если запись не удалась, строки возвращаются в начало буфера
+        и исключение пробрасывается дальше.
+        """
+        with self._analytics_flush_lock:
+            with self._analytics_lock:
+                rows, self._analytics_buf = self._analytics_buf, []
+                if self._analytics_timer is not None:
+                    self._analytics_timer.cancel()
+                    self._analytics_timer = None
+            try:
+                self._bulk_insert('analytics_messages', rows)
+            except BaseException:
+                with self._analytics_lock:
+                    self._analytics_buf[:0] = rows   # Перед записями, добавленными во время сброса
+                raise
+
+    def _flush_analytics_on_timer(self):
+        """
+        Сброс буфера аналитики из потока таймера с записью ошибок в журнал.
+        
+        При ошибке таймер взводится снова, чтобы повторить сброс.
+        """
+        try:
+            self.flush_analytics()
+        except Exception:
+            logging.getLogger('ChatApp').exception("Failed to flush analytics buffer")
+            with self._analytics_lock:
+                self._arm_analytics_timer()
+
+    def get_analytics_history(self, since_ts=None, limit=None):
+        """
+        Получение истории аналитики в хронологическом порядке.
+        
+        Args:
+            since_ts (int, optional): Только записи не раньше этого времени (миллисекунды Unix)
+            limit (int, optional): Вернуть только limit самых новых записей
+                                   (None — без ограничения)
+        
+        Returns:
+            list: Список строк (timestamp, model, message_length, response_time, tokens_used)
+        """
+        self.flush_analytics()
+        sql, params = _SQL_SELECT_ANALYTICS, []
+        if since_ts is not None:
+            sql += _SQL_WHERE_ANALYTICS_SINCE
+            params.append(since_ts)
+        if limit is None:
+            sql += " ORDER BY timestamp ASC"
+        else:
+            # Самые новые записи выбираются по индексу в обратном порядке и разворачиваются
+            sql = f"SELECT * FROM ({sql} ORDER BY timestamp DESC LIMIT ?) ORDER BY timestamp ASC"
+            params.append(limit)
+        with self.connection() as (_, cursor):
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def get_cached_response(self, key: str, ttl: int):
+        """
+        Получение сохранённого ответа API, если он не старше ttl секунд.
+        
+        Args:
+            key (str): Хэш запроса
+            ttl (int): Срок жизни записи в секундах
+        
+        Returns:
+            dict: Ответ API или None, если запись отсутствует или устарела
+        """
+        with self.connection() as (_, cursor):
+            cursor.execute(
+                "SELECT payload FROM response_cache WHERE key = ? AND ts > ?",
+                (key, int(time.time()) - ttl)
+            )
+            row = cursor.fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def save_cached_response(self, key: str, payload: dict, ttl: int):
+        """
+        Сохранение ответа API в кэш с удалением устаревших записей.
+        
+        Args:
+            key (str): Хэш запроса
+            payload (dict): Ответ API
+            ttl (int): Срок жизни записей в секундах
+        """
+        now = int(time.time())
+        with self.transaction() as (_, cursor):
+            cursor.execute("DELETE FROM response_cache WHERE ts <= ?", (now - ttl,))
+            cursor.execute(
+                "INSERT OR REPLACE INTO response_cache (key, payload, ts) VALUES (?, ?, ?)",
+                (key, orjson.dumps(payload).decode(), now)
+            )
+
+    def clear_history(self, vacuum=False):
+        """
+        Полная очистка истории чата, аналитики и кэша ответов API.
+        
+        Таблицы истории удаляются и создаются заново в одной транзакции: в отличие
+        от DELETE, в WAL не попадает каждая удалённая страница. В той же транзакции
+        очищается кэш ответов, чтобы удалённые диалоги не хранились на диске.
+        После этого WAL переносится в файл базы и обнуляется. Нумерация id начинается заново.
+        
+        Args:
+            vacuum (bool): После очистки сжать файл базы (VACUUM)
+        
+        Raises:
+            RuntimeError: Если вызвана внутри transaction()
+        """
+        self._check_no_transaction('clear_history')
+        self.flush()                           # Записи из очереди не должны появиться после очистки
+        self.flush_analytics()
+        try:
+            with self.transaction() as (_, cursor):
+                cursor.execute('DROP TABLE IF EXISTS messages')
+                cursor.execute('DROP TABLE IF EXISTS analytics_messages')
+                for ddl in _SQL_HISTORY_SCHEMA:
+                    cursor.execute(ddl)
+                cursor.execute('DELETE FROM response_cache')
+        finally:
+            self._invalidate_history()
+
+        # VACUUM и контрольная точка невозможны внутри транзакции — выполняются после COMMIT
+        with self.connection() as (_, cursor):
+            if vacuum:
+                cursor.execute("VACUUM")
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # Перенос изменений из WAL в файл и обнуление WAL
 
     def set_api_key_and_pin(self, api_key: str, pin: str):
         """
@@ -148,12 +757,22 @@ class ChatCache:
         Args:
             api_key (str): Ключ от OpenRouter
             pin (str): 4-значный PIN-код
+        
+        Returns:
+            tuple: (api_key, pin) в том виде, в каком они записаны в базу
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM auth")  # Очищаем старую запись (хранится только одна)
-        cursor.execute("INSERT INTO auth (api_key, pin) VALUES (?, ?)", (api_key, pin))
-        conn.commit()
+        # Запись и обновление кэша под одной блокировкой: чтение не увидит старые данные
+        with self._cache_lock, self.transaction() as (_, cursor):
+            # Хранится только одна запись с id = 1 — обновляем её на месте и сразу
+            # получаем сохранённые значения без отдельного SELECT
+            cursor.execute('''
+                INSERT INTO auth (id, api_key, pin) VALUES (1, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET api_key = excluded.api_key, pin = excluded.pin
+                RETURNING api_key, pin
+            ''', (api_key, pin))
+            row = cursor.fetchone()
+            self._auth_cache = (row[0], row[1])
+            return self._auth_cache
 
     def get_api_key_and_pin(self):
         """
@@ -162,15 +781,17 @@ class ChatCache:
         Returns:
             tuple: (api_key, pin) или (None, None)
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT api_key, pin FROM auth")
-        row = cursor.fetchone()
-        return (row[0], row[1]) if row else (None, None)
+        with self._cache_lock:
+            if self._auth_cache is None:
+                with self.connection() as (_, cursor):
+                    cursor.execute("SELECT api_key, pin FROM auth")
+                    row = cursor.fetchone()
+                self._auth_cache = (row[0], row[1]) if row else (None, None)
+            return self._auth_cache
 
     def clear_auth(self):
         """Полный сброс аутентификации (удаление ключа и PIN)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM auth")
-        conn.commit()
\ No newline at end of file
+        with self.transaction() as (_, cursor):
+            cursor.execute("DELETE FROM auth")
+        with self._cache_lock:
+            self._auth_cache = None
\ No newline at end of file